@@ -4,10 +4,10 @@ import json
 def check_file(expected, filename):
     with open(filename) as f:
         data = json.load(f)
-    by_years = {}
-    for r in data['curves'][0]['results']:
-        years = tuple(r['period'])
-        by_years[years] = r['vs_time']
+    by_years = {
+        tuple(r['period']): r['vs_time']
+        for r in data['curves'][0]['results']
+    }
     for exp in expected:
         year = int(exp['collectioncode'])
         years = (year, year + 20)
@@ -1,9 +1,7 @@
 import argparse
 import json
 import logging
-import matplotlib
-import matplotlib.pyplot as plt
-import types3.plot
+import types3
 
 cli = argparse.ArgumentParser()
 cli.add_argument('--verbose',
@@ -25,19 +23,24 @@ cli.add_argument('--version',
 
 
 def plot(args):
-    matplotlib.use('Agg')
+    logging.info(f'read: {args.infile}')
+    with open(args.infile) as f:
+        data = json.load(f)
+    logging.info('plot...')
+    # Imported only once there is something to plot
+    import matplotlib
+    from matplotlib.figure import Figure
+    import types3.plot
     matplotlib.rcParams['axes.titlesize'] = 'medium'
     matplotlib.rcParams['savefig.dpi'] = args.dpi
     if args.large:
         matplotlib.rcParams['font.size'] = 14
         matplotlib.rcParams['axes.titlepad'] = 10
-    logging.info(f'read: {args.infile}')
-    with open(args.infile) as f:
-        data = json.load(f)
-    logging.info('plot...')
     dims = types3.plot.DIMS_PLOT_WIDE if args.wide else types3.plot.DIMS_PLOT
     dims = types3.plot.set_height(data, dims)
-    fig = plt.figure(figsize=(dims.width, dims.height))
+    # Not attached to any backend: savefig picks the PDF or Agg canvas
+    # based on the file extension
+    fig = Figure(figsize=(dims.width, dims.height))
     types3.plot.plot(fig, data, dims, legend=args.legend)
     logging.info(f'write: {args.outfile}')
     fig.savefig(args.outfile)
@@ -24,9 +24,34 @@ OUTPUT_VERSION = 'v4'
 MIN_ITER = 1_000
 MAX_ITER = 1_000_000
 ITER_STEP = 10
-TIMEOUT = 0.1
 WINDOW_INIT_SIZE = '1200x1050'
 WIDGET_WIDTH = 300
+UPDATE_DELAY = 150
+
+FILETYPES = {
+    'PDF': [('PDF', '*.pdf')],
+    'PNG': [('PNG', '*.png')],
+}
+
+# Extra arguments, and whether marked tokens apply
+WHAT_ARGS = {
+    'types vs. tokens, using samples': ([], False),
+    'types vs. tokens, individually': (['--split-samples'], False),
+    'types vs. words, using samples': (['--words'], False),
+    'hapaxes vs. tokens, using samples': (['--count-hapaxes'], False),
+    'hapaxes vs. tokens, individually':
+    (['--count-hapaxes', '--split-samples'], False),
+    'hapaxes vs. words, using samples': (['--count-hapaxes',
+                                          '--words'], False),
+    'tokens vs. tokens, using samples': (['--count-tokens'], False),
+    'tokens vs. tokens, individually': (['--count-tokens',
+                                         '--split-samples'], False),
+    'tokens vs. words, using samples': (['--count-tokens', '--words'], False),
+    'samples vs. tokens': (['--count-samples'], False),
+    'samples vs. words': (['--count-samples', '--words'], False),
+    'type ratio, using samples': (['--type-ratio'], True),
+    'type ratio, individually': (['--type-ratio', '--split-samples'], True),
+}
 
 cli = argparse.ArgumentParser()
 cli.add_argument('--verbose',
@@ -57,7 +82,7 @@ def metadata_choices(metadata):
         for v in sorted(metadata[k]):
             l = f'{k}: {v}'
             assert l not in m
-            m[l] = (k, v)
+            m[l] = f'{k}={v}'
             r.append(l)
     return m, r
 
@@ -87,78 +112,89 @@ def cmd_digest(x):
 class Runner:
 
     def __init__(self, infile, cachedir, verbose, runner_queue, result_queue,
-                 root):
+                 result_pending, root):
         self.infile = infile
         self.cachedir = cachedir
-        self.verbose = verbose
+        basedir = Path(os.environ['TYPES3_BASEDIR'])
+        self.tool = basedir / 'target/release/types3'
+        self.verbose_args = ['--verbose'] * verbose
         self.runner_queue = runner_queue
         self.result_queue = result_queue
+        self.result_pending = result_pending
         self.root = root
         self.current = None
+        self.digest = None
         self.process = None
         self.iter = None
 
     def msg(self, x):
         self.result_queue.put(x)
-        self.root.event_generate('<<NewResults>>')
+        # One event is enough until the UI has started draining the queue
+        if not self.result_pending.is_set():
+            self.result_pending.set()
+            self.root.event_generate('<<NewResults>>')
 
     def start_cmd(self):
         assert self.process is None
         assert self.current is not None
         assert self.iter is not None
-        digest = cmd_digest(self.current)
+        digest = self.digest
         self.errfile = self.cachedir / f'{digest}-{self.iter}.err'
         self.tempfile = self.cachedir / f'{digest}-{self.iter}.new'
         self.outfile = self.cachedir / f'{digest}-{self.iter}.json'
-        basedir = Path(os.environ['TYPES3_BASEDIR'])
-        tool = basedir / 'target/release/types3'
-        base_args = [
-            tool, self.infile, self.tempfile, '--error-file', self.errfile,
-            '--iter',
+        full_cmd = [
+            self.tool, self.infile, self.tempfile, '--error-file',
+            self.errfile, '--iter',
             str(self.iter)
-        ]
-        for _ in range(self.verbose):
-            base_args += ['--verbose']
-        full_cmd = base_args + self.current
+        ] + self.verbose_args + list(self.current)
         logging.debug(f'starting: {full_cmd}...')
         try:
-            self.process = subprocess.Popen(full_cmd)
+            # Without close_fds, subprocess can use posix_spawn. Python
+            # opens its own descriptors non-inheritable (PEP 446), but
+            # any that C libraries such as Tcl/Tk or Xlib open without
+            # O_CLOEXEC are inherited; the tool never touches them
+            self.process = subprocess.Popen(full_cmd, close_fds=False)
         except Exception as e:
             logging.warning(f'starting {full_cmd} failed with {e}')
             error = 'Cannot start calculations.'
-            self.msg(('ERROR', self.current, self.iter, error))
+            self.msg(('ERROR', self.digest, self.iter, error))
             self.iter = None
             self.current = None
+            return
+        threading.Thread(target=self.wait, args=(self.process, ),
+                         daemon=True).start()
+
+    def wait(self, process):
+        # Wakes up run() when the process exits
+        process.wait()
+        self.runner_queue.put(process)
 
-    def process_poll(self):
+    def process_done(self):
         assert self.process is not None
         assert self.current is not None
         assert self.iter is not None
-        ret = self.process.poll()
-        if ret is None:
-            return
+        ret = self.process.wait()
         self.process = None
         if ret != 0:
             error = 'Unknown error during calculation.'
-            if self.errfile.exists():
-                with open(self.errfile) as f:
-                    error_struct = json.load(f)
-                    error = error_struct['error']
-                self.errfile.unlink()
-            else:
+            try:
+                error = json.loads(self.errfile.read_bytes())['error']
+            except FileNotFoundError:
                 logging.warning('process failed without telling why')
-            self.msg(('ERROR', self.current, self.iter, error))
+            else:
+                self.errfile.unlink()
+            self.msg(('ERROR', self.digest, self.iter, error))
             self.iter = None
             self.current = None
             return
         logging.debug('process finished successfully')
-        self.tempfile.rename(self.outfile)
+        self.tempfile.replace(self.outfile)
         if self.iter < MAX_ITER:
-            self.msg(('DONE-WORKING', self.current, self.iter, None))
+            self.msg(('DONE-WORKING', self.digest, self.iter, None))
             self.iter *= ITER_STEP
             self.start_cmd()
         else:
-            self.msg(('DONE', self.current, self.iter, None))
+            self.msg(('DONE', self.digest, self.iter, None))
             logging.debug('all iterations done')
             self.iter = None
             self.current = None
@@ -180,46 +216,56 @@ class Runner:
         assert self.process is None
         assert self.current is not None
         assert self.iter is not None
-        digest = cmd_digest(self.current)
+        digest = self.digest
+        # Iterations always finish in increasing order, so the largest
+        # cached one tells where to continue
         best = None
-        all_done = False
-        while True:
-            cached = self.cachedir / f'{digest}-{self.iter}.json'
+        iter = MAX_ITER
+        while iter >= MIN_ITER:
+            cached = self.cachedir / f'{digest}-{iter}.json'
             if cached.exists():
-                best = self.iter
-                if self.iter < MAX_ITER:
-                    self.iter *= ITER_STEP
-                else:
-                    all_done = True
-                    break
-            else:
+                best = iter
                 break
-        if all_done:
-            self.msg(('DONE', self.current, self.iter, None))
+            iter //= ITER_STEP
+        if best == MAX_ITER:
+            self.msg(('DONE', self.digest, best, None))
             logging.debug('all iterations in cache')
             self.iter = None
             self.current = None
         else:
             if best is not None:
-                self.msg(('DONE-WORKING', self.current, best, None))
+                self.msg(('DONE-WORKING', self.digest, best, None))
+                self.iter = best * ITER_STEP
             else:
-                self.msg(('WORKING', self.current, 0, None))
+                self.msg(('WORKING', self.digest, 0, None))
             self.start_cmd()
 
-    def run(self):
-        logging.debug('runner started')
+    def commands(self):
         while True:
-            if self.process:
-                need_poll = False
+            batch = [self.runner_queue.get()]
+            while True:
                 try:
-                    cmd = self.runner_queue.get(timeout=TIMEOUT)
+                    batch.append(self.runner_queue.get_nowait())
                 except queue.Empty:
-                    need_poll = True
-                if need_poll:
-                    self.process_poll()
-                    continue
-            else:
-                cmd = self.runner_queue.get()
+                    break
+            # Commands superseded within the batch are skipped, but all
+            # process exits are passed on in order
+            last = None
+            for i, x in enumerate(batch):
+                if not isinstance(x, subprocess.Popen):
+                    last = i
+            for i, x in enumerate(batch):
+                if isinstance(x, subprocess.Popen) or i == last:
+                    yield x
+
+    def run(self):
+        logging.debug('runner started')
+        for cmd in self.commands():
+            if isinstance(cmd, subprocess.Popen):
+                # Exits of terminated processes are no longer of interest
+                if cmd is self.process:
+                    self.process_done()
+                continue
             if cmd == self.current:
                 continue
             if self.process:
@@ -229,6 +275,7 @@ class Runner:
             assert self.iter is None
             self.iter = MIN_ITER
             self.current = cmd
+            self.digest = cmd_digest(cmd)
             self.try_cache()
         logging.debug('runner done')
 
@@ -237,40 +284,93 @@ class App:
 
     def __init__(self, root, args):
         root.title('types3')
+        self.root = root
         self.verbose = args.verbose
         self.infile = args.infile
         self.cur_args = None
         self.cur_outfile = None
-        self._read_infile()
+        self.layout_key = None
+        self.cur_inputs = None
+        self.pending_update = None
+        self.cacheroot = Path(
+            appdirs.user_cache_dir('types3')) / OUTPUT_VERSION
+        self._read_summary()
         self._setup_cache()
         self._build_ui(root)
         self._setup_menu(root)
         self._setup_hooks(root)
         logging.debug('ready')
 
+    def _read_summary(self):
+        # Unchanged input files are recognized by path, size, and mtime
+        st = os.stat(self.infile)
+        key = cmd_digest(
+            [os.path.abspath(self.infile), st.st_size, st.st_mtime_ns])
+        summary_file = self.cacheroot / 'infiles' / f'{key}.json'
+        try:
+            with open(summary_file) as f:
+                self._use_summary(json.load(f))
+            logging.debug(f'read: {summary_file}')
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f'ignoring {summary_file}: {e}')
+        summary = self._read_infile()
+        self._use_summary(summary)
+        try:
+            summary_file.parent.mkdir(parents=True, exist_ok=True)
+            tempfile = summary_file.with_suffix('.new')
+            with open(tempfile, 'w') as f:
+                json.dump(summary, f)
+            tempfile.replace(summary_file)
+        except OSError as e:
+            logging.warning(f'cannot write {summary_file}: {e}')
+
+    def _use_summary(self, summary):
+        self.data_digest = summary['data_digest']
+        self.sample_metadata = {
+            k: set(v)
+            for k, v in summary['sample_metadata'].items()
+        }
+        self.token_metadata = {
+            k: set(v)
+            for k, v in summary['token_metadata'].items()
+        }
+        self.default_step = max(summary['gcd'], 10)
+
     def _read_infile(self):
         logging.debug(f'read: {self.infile}')
-        with open(self.infile) as f:
-            raw_data = f.read()
-        raw_bytes = bytes(raw_data, encoding='utf-8')
-        self.data_digest = hashlib.sha256(raw_bytes).hexdigest()
-        data = json.loads(raw_data)
-        years = set()
-        self.sample_metadata = defaultdict(set)
-        self.token_metadata = defaultdict(set)
+        with open(self.infile, 'rb') as f:
+            raw_bytes = f.read()
+        data_digest = hashlib.sha256(raw_bytes).hexdigest()
+        data = json.loads(raw_bytes)
+        del raw_bytes
+        gcd = 0
+        sample_metadata = defaultdict(set)
+        token_metadata = defaultdict(set)
         for s in data['samples']:
-            years.add(s['year'])
+            gcd = math.gcd(gcd, s['year'])
             for k, v in s['metadata'].items():
-                self.sample_metadata[k].add(v)
+                sample_metadata[k].add(v)
             for t in s['tokens']:
                 for k, v in t['metadata'].items():
-                    self.token_metadata[k].add(v)
-        gcd = math.gcd(*years)
-        self.default_step = max(gcd, 10)
+                    token_metadata[k].add(v)
+        return dict(
+            data_digest=data_digest,
+            sample_metadata={
+                k: sorted(v)
+                for k, v in sample_metadata.items()
+            },
+            token_metadata={
+                k: sorted(v)
+                for k, v in token_metadata.items()
+            },
+            gcd=gcd,
+        )
 
     def _setup_cache(self):
-        self.cachedir = Path(appdirs.user_cache_dir(
-            'types3')) / OUTPUT_VERSION / self.data_digest
+        self.cachedir = self.cacheroot / self.data_digest
         self.cachedir.mkdir(parents=True, exist_ok=True)
         logging.debug(f'cache directory: {self.cachedir}')
 
@@ -388,11 +488,12 @@ class App:
         e.grid(column=1, row=row, sticky='w')
         row += 1
 
+        token_choices = metadata_choices(self.token_metadata)
+
         e = ttk.Label(widgetframe, text='What is relevant:')
         e.grid(column=0, row=row, sticky='e')
         self.mark_tokens = tk.StringVar()
-        self.mark_tokens_map, mark_tokens_choices = metadata_choices(
-            self.token_metadata)
+        self.mark_tokens_map, mark_tokens_choices = token_choices
         e = ttk.OptionMenu(widgetframe, self.mark_tokens,
                            mark_tokens_choices[0], *mark_tokens_choices)
         e.grid(column=1, row=row, sticky='w')
@@ -424,8 +525,7 @@ class App:
         e = ttk.Label(widgetframe, text='Token restriction:')
         e.grid(column=0, row=row, sticky='e')
         self.restrict_tokens = tk.StringVar()
-        self.restrict_tokens_map, restrict_tokens_choices = metadata_choices(
-            self.token_metadata)
+        self.restrict_tokens_map, restrict_tokens_choices = token_choices
         e = ttk.OptionMenu(widgetframe, self.restrict_tokens,
                            restrict_tokens_choices[0],
                            *restrict_tokens_choices)
@@ -541,7 +641,6 @@ class App:
         dims = types3.plot.DIMS_UI
         self.fig = Figure(figsize=(dims.width, dims.height))
         self.canvas = FigureCanvasTkAgg(self.fig, master=scrollableframe)
-        self.canvas.draw()
         e = self.canvas.get_tk_widget()
         e.grid(column=0, row=0, sticky='ne')
 
@@ -561,10 +660,14 @@ class App:
         self.restrict_tokens.trace_add('write', self.update)
         self.mark_tokens.trace_add('write', self.update)
         root.bind('<<NewResults>>', self.new_results)
-        self.result_queue = queue.Queue()
+        root.bind('<<SaveFailed>>', self.save_failed)
+        self.save_errors = queue.SimpleQueue()
+        self.result_queue = queue.SimpleQueue()
+        self.result_pending = threading.Event()
         self.runner_queue = queue.Queue()
         runner = Runner(self.infile, self.cachedir, self.verbose,
-                        self.runner_queue, self.result_queue, root)
+                        self.runner_queue, self.result_queue,
+                        self.result_pending, root)
         self.runner_thread = threading.Thread(target=runner.run)
         self.runner_thread.start()
         self.update()
@@ -583,7 +686,7 @@ class App:
             return None
         try:
             x = int(v)
-        except:
+        except ValueError:
             errors.append(f'{label} is not a valid number.')
             return None
         if vmin is not None and x < vmin:
@@ -595,6 +698,22 @@ class App:
         return x
 
     def update(self, *x):
+        inputs = tuple(v.get() for v in [
+            self.minimum_size,
+            self.window,
+            self.step,
+            self.start,
+            self.end,
+            self.offset,
+            self.category,
+            self.restrict_samples,
+            self.restrict_tokens,
+            self.mark_tokens,
+            self.what,
+        ])
+        if inputs == self.cur_inputs:
+            return
+        self.cur_inputs = inputs
         args = []
         errors = []
         minimum_size = self.parse_opt_int(errors, 'Minimum size', 1, None,
@@ -627,34 +746,15 @@ class App:
         restrict_samples = self.restrict_samples_map[
             self.restrict_samples.get()]
         if restrict_samples is not None:
-            args += ['--restrict-samples', '='.join(restrict_samples)]
+            args += ['--restrict-samples', restrict_samples]
         restrict_tokens = self.restrict_tokens_map[self.restrict_tokens.get()]
         if restrict_tokens is not None:
-            args += ['--restrict-tokens', '='.join(restrict_tokens)]
+            args += ['--restrict-tokens', restrict_tokens]
         mark_tokens = self.mark_tokens_map[self.mark_tokens.get()]
         if mark_tokens is not None:
-            args += ['--mark-tokens', '='.join(mark_tokens)]
+            args += ['--mark-tokens', mark_tokens]
         what = self.what.get()
-        extra, marked = {
-            'types vs. tokens, using samples': ([], False),
-            'types vs. tokens, individually': (['--split-samples'], False),
-            'types vs. words, using samples': (['--words'], False),
-            'hapaxes vs. tokens, using samples': (['--count-hapaxes'], False),
-            'hapaxes vs. tokens, individually':
-            (['--count-hapaxes', '--split-samples'], False),
-            'hapaxes vs. words, using samples':
-            (['--count-hapaxes', '--words'], False),
-            'tokens vs. tokens, using samples': (['--count-tokens'], False),
-            'tokens vs. tokens, individually':
-            (['--count-tokens', '--split-samples'], False),
-            'tokens vs. words, using samples': (['--count-tokens',
-                                                 '--words'], False),
-            'samples vs. tokens': (['--count-samples'], False),
-            'samples vs. words': (['--count-samples', '--words'], False),
-            'type ratio, using samples': (['--type-ratio'], True),
-            'type ratio, individually': (['--type-ratio',
-                                          '--split-samples'], True),
-        }.get(what, ([], False))
+        extra, marked = WHAT_ARGS.get(what, ([], False))
         args += extra
         if marked:
             self.mark_tokens_menu.configure(state="normal")
@@ -664,9 +764,18 @@ class App:
             logging.debug(errors)
             self.error.set('\n'.join(errors))
             return
+        args = tuple(args)
         if self.cur_args != args:
             self.cur_args = args
-            self.runner_queue.put(args)
+            # Only the last of several quick changes is started
+            if self.pending_update is not None:
+                self.root.after_cancel(self.pending_update)
+            self.pending_update = self.root.after(UPDATE_DELAY, self.submit,
+                                                  args)
+
+    def submit(self, args):
+        self.pending_update = None
+        self.runner_queue.put(args)
 
     def run(self, root):
         root.mainloop()
@@ -676,6 +785,7 @@ class App:
         logging.debug('done')
 
     def new_results(self, *_):
+        self.result_pending.clear()
         to_draw = None
         while True:
             try:
@@ -683,17 +793,17 @@ class App:
             except queue.Empty:
                 break
             logging.debug(x)
-            what, cmd, iter, error = x
+            what, digest, iter, error = x
             if what == 'WORKING':
                 to_draw = None
                 self.iter.set('… (working)')
                 self.error.set('')
             elif what == 'DONE-WORKING':
-                to_draw = (cmd, iter)
+                to_draw = (digest, iter)
                 self.iter.set(f'{iter}… (more coming)')
                 self.error.set('')
             elif what == 'DONE':
-                to_draw = (cmd, iter)
+                to_draw = (digest, iter)
                 self.iter.set(f'{iter} (all done)')
                 self.error.set('')
             elif what == 'ERROR':
@@ -704,29 +814,32 @@ class App:
         if to_draw:
             self.draw(*to_draw)
 
-    def draw(self, cmd, iter):
-        digest = cmd_digest(cmd)
+    def draw(self, digest, iter):
         outfile = self.cachedir / f'{digest}-{iter}.json'
+        if outfile == self.cur_outfile:
+            return
         self.cur_outfile = outfile
         with open(outfile) as f:
             data = json.load(f)
 
-        self.fig.clear()
         dims = types3.plot.DIMS_UI
-        types3.plot.plot(self.fig, data, dims, legend='lower right')
-        self.canvas.draw()
+        layout_key = types3.plot.layout_key(data, dims)
+        if layout_key == self.layout_key:
+            types3.plot.clear_curves(self.axes)
+        else:
+            self.fig.clear()
+            self.axes = types3.plot.add_axes(self.fig, data, dims)
+            self.layout_key = layout_key
+        types3.plot.plot_curves(self.axes, data, legend='lower right')
+        self.canvas.draw_idle()
 
     def save(self, *_):
         if self.cur_outfile is None:
             return
-        ftmap = {
-            'PDF': [('PDF', '*.pdf')],
-            'PNG': [('PNG', '*.png')],
-        }
         fmt = self.save_format.get()
-        if fmt not in ftmap:
+        if fmt not in FILETYPES:
             fmt = 'PDF'
-        filetypes = ftmap[fmt]
+        filetypes = FILETYPES[fmt]
         save_filename = tk.filedialog.asksaveasfilename(
             filetypes=filetypes,
             defaultextension=filetypes,
@@ -750,10 +863,28 @@ class App:
             cmd += ['--large']
         for _ in range(self.verbose):
             cmd += ['--verbose']
+        # Exporting can take a while, keep the UI responsive meanwhile
+        threading.Thread(target=self.export, args=(cmd, save_filename)).start()
+
+    def export(self, cmd, save_filename):
         try:
             subprocess.run(cmd, check=True)
         except Exception as e:
             logging.warning(f'starting {cmd} failed with {e}')
+            self.save_errors.put(save_filename)
+            try:
+                self.root.event_generate('<<SaveFailed>>')
+            except (RuntimeError, tk.TclError):
+                # The window was closed during the export, and the
+                # failure has already been logged
+                pass
+
+    def save_failed(self, *_):
+        while True:
+            try:
+                save_filename = self.save_errors.get_nowait()
+            except queue.Empty:
+                break
             tk.messagebox.showerror(
                 message=f'Could not export as {save_filename}')
 
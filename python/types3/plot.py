@@ -1,5 +1,6 @@
 import math
 from collections import namedtuple
+import numpy as np
 
 COLORS = ['#f26924', '#0088cc', '#3ec636']
 MAX_SIGNIFICANCE = 4
@@ -10,6 +11,8 @@ Dims = namedtuple('Dims', [
     'columns'
 ])
 
+Axes = namedtuple('Axes', ['ax1', 'axs2', 'axs3'])
+
 DIMS_UI = Dims(
     h1=4,
     h2=0.8,
@@ -68,29 +71,30 @@ def _catname(cats):
 
 
 def _significance(x, n):
-    assert 0 <= x <= n
+    assert np.all((0 <= x) & (x <= n))
     p = (n - x) / n
-    try:
-        return min(MAX_SIGNIFICANCE, -math.log10(p))
-    except ValueError:
-        return MAX_SIGNIFICANCE
+    with np.errstate(divide='ignore'):
+        return np.minimum(MAX_SIGNIFICANCE, -np.log10(p))
+
 
+def _get_x(results):
+    return np.array([r['period'][0] for r in results])
 
-def _get_avg(r):
-    period = r['period']
-    x = period[0]
-    ar = r['average_at_limit']
-    y = (ar['low'] + ar['high']) / (2 * ar['iter'])
-    return (x, y)
 
+def _get_avg(results):
+    ar = [r['average_at_limit'] for r in results]
+    low = np.array([a['low'] for a in ar])
+    high = np.array([a['high'] for a in ar])
+    iter = np.array([a['iter'] for a in ar])
+    return (low + high) / (2 * iter)
 
-def _get_vs(r, what):
-    period = r['period']
-    x = period[0]
-    pr = r[what]
-    above = _significance(pr['above'], pr['iter'])
-    below = _significance(pr['below'], pr['iter'])
-    return (x, above, -below)
+
+def _get_vs(results, what):
+    pr = [r[what] for r in results]
+    above = np.array([a['above'] for a in pr])
+    below = np.array([a['below'] for a in pr])
+    iter = np.array([a['iter'] for a in pr])
+    return _significance(above, iter), -_significance(below, iter)
 
 
 def _upcase(x):
@@ -146,10 +150,23 @@ def set_height(data, dims):
     return dims._replace(height=y)
 
 
-def plot(fig, data, dims, legend):
+def _new_axes(fig, dims, col, y, h):
+    return fig.add_axes([
+        col / dims.width, 1 - y / dims.height, dims.w / dims.width,
+        h / dims.height
+    ])
+
+
+def layout_key(data, dims):
+    periods = tuple(tuple(p) for p in data['periods'])
+    curves = data['curves']
+    has_cats = curves[0]['category'] is not None
+    return dims, periods, len(curves), has_cats, _title(data)
+
+
+def add_axes(fig, data, dims):
     periods = data['periods']
     curves = data['curves']
-    restrictions = [data['restrict_samples'], data['restrict_tokens']]
     has_cats = curves[0]['category'] is not None
 
     xx = [a for (a, b) in periods]
@@ -168,10 +185,7 @@ def plot(fig, data, dims, legend):
     axs3 = []
     y = dims.m1
     y += dims.h1
-    ax = fig.add_axes([
-        col / dims.width, 1 - y / dims.height, dims.w / dims.width,
-        dims.h1 / dims.height
-    ])
+    ax = _new_axes(fig, dims, col, y, dims.h1)
     ax.set_title(_title(data))
     ax.set_xlim(xlimits)
     ax.set_xticks(xx, [])
@@ -186,10 +200,7 @@ def plot(fig, data, dims, legend):
         if i != 0:
             y += dims.m3
         y += dims.h2
-        ax = fig.add_axes([
-            col / dims.width, 1 - y / dims.height, dims.w / dims.width,
-            dims.h2 / dims.height
-        ])
+        ax = _new_axes(fig, dims, col, y, dims.h2)
         if i == 0:
             ax.set_title('Significance of differences in time')
         ax.set_ylim(
@@ -206,10 +217,7 @@ def plot(fig, data, dims, legend):
             if i != 0:
                 y += dims.m3
             y += dims.h2
-            ax = fig.add_axes([
-                col / dims.width, 1 - y / dims.height, dims.w / dims.width,
-                dims.h2 / dims.height
-            ])
+            ax = _new_axes(fig, dims, col, y, dims.h2)
             if i == 0:
                 ax.set_title(
                     'Significance in comparison with other categories')
@@ -221,6 +229,31 @@ def plot(fig, data, dims, legend):
             axs3.append(ax)
             last = ax
     last.set_xticks(xx, periodlabels, rotation='vertical')
+    return Axes(ax1, axs2, axs3)
+
+
+def clear_curves(axes):
+    for ax in [axes.ax1] + axes.axs2 + axes.axs3:
+        for artist in ax.lines + ax.collections:
+            artist.remove()
+    legend = axes.ax1.get_legend()
+    if legend is not None:
+        legend.remove()
+
+
+def _plot_band(ax, xx, yy1, yy2, color):
+    ax.fill_between(xx, yy1, yy2, color=color, alpha=0.7, linewidth=0)
+    msig = min(math.ceil(max(yy1.max(), -yy2.min())), MAX_SIGNIFICANCE)
+    for i in range(1, msig):
+        ax.fill_between(xx, -i, +i, color='#ffffff', alpha=0.4, linewidth=0)
+    ax.axhline(0, color='#000000', linewidth=0.8)
+
+
+def plot_curves(axes, data, legend):
+    curves = data['curves']
+    restrictions = [data['restrict_samples'], data['restrict_tokens']]
+    has_cats = curves[0]['category'] is not None
+    ax1, axs2, axs3 = axes
 
     ymax = 1
     for i, curve in enumerate(curves):
@@ -231,8 +264,8 @@ def plot(fig, data, dims, legend):
         else:
             color = '#000000'
         label = _catname(restrictions + [curve['category']])
-        points = [_get_avg(r) for r in curve['results']]
-        xx, yy = zip(*points)
+        xx = _get_x(curve['results'])
+        yy = _get_avg(curve['results'])
         ax1.plot(xx,
                  yy,
                  label=label,
@@ -240,27 +273,18 @@ def plot(fig, data, dims, legend):
                  markeredgecolor=color,
                  markerfacecolor=color,
                  marker='o')
-        ymax = max(ymax, max(yy))
-
-        def plotter(ax, points):
-            xx, yy1, yy2 = zip(*points)
-            ax.fill_between(xx, yy1, yy2, color=color, alpha=0.7, linewidth=0)
-            msig = min(math.ceil(max(max(yy1), -min(yy2))), MAX_SIGNIFICANCE)
-            for i in range(1, msig):
-                ax.fill_between(xx,
-                                -i,
-                                +i,
-                                color='#ffffff',
-                                alpha=0.4,
-                                linewidth=0)
-            ax.axhline(0, color='#000000', linewidth=0.8)
-
-        points = [_get_vs(r, 'vs_time') for r in curve['results']]
-        plotter(axs2[i], points)
+        ymax = max(ymax, yy.max())
+
+        yy1, yy2 = _get_vs(curve['results'], 'vs_time')
+        _plot_band(axs2[i], xx, yy1, yy2, color)
 
         if has_cats:
-            points = [_get_vs(r, 'vs_categories') for r in curve['results']]
-            plotter(axs3[i], points)
+            yy1, yy2 = _get_vs(curve['results'], 'vs_categories')
+            _plot_band(axs3[i], xx, yy1, yy2, color)
 
     ax1.set_ylim((0, ymax * 1.05))
     ax1.legend(loc=legend)
+
+
+def plot(fig, data, dims, legend):
+    plot_curves(add_axes(fig, data, dims), data, legend)
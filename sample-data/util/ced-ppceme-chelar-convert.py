@@ -1,6 +1,7 @@
 import json
 import re
 import sys
+from operator import itemgetter
 
 # Genre classifications from https://github.com/suomela/suffix-competition-code
 
@@ -44,26 +45,30 @@ CLASS_LEGAL = {
     'Science, other': 'other',
 }
 
+GENRE_META = {g: (CLASS_SPEECH[g], CLASS_LEGAL[g]) for g in CLASS_SPEECH}
+
+# One of: a single year, a range within a century, or a full range
+YEAR = re.compile(
+    r'[ac]?(?P<year>1[5-7][0-9][0-9])'
+    r'|c?(?P<century>1[5-7])(?P<a>[0-9][0-9])-c?(?P<b>[0-9][0-9])'
+    r'|c?(?P<y1>1[5-7][0-9][0-9])-c?(?P<y2>1[5-7][0-9][0-9])')
+
 # Ranges of years are replaced with the midpoint
 
 
 def parse_year(x):
-    m = re.fullmatch(r'[ac]?(1[5-7][0-9][0-9])', x)
-    if m:
-        return int(m.group(1))
-    m = re.fullmatch(r'c?(1[5-7])([0-9][0-9])-c?([0-9][0-9])', x)
-    if m:
-        y1 = int(m.group(1) + m.group(2))
-        y2 = int(m.group(1) + m.group(3))
-        y = round((y1 + y2) / 2)
-        return y
-    m = re.fullmatch(r'c?(1[5-7][0-9][0-9])-c?(1[5-7][0-9][0-9])', x)
-    if m:
-        y1 = int(m.group(1))
-        y2 = int(m.group(2))
-        y = round((y1 + y2) / 2)
-        return y
-    assert False, x
+    m = YEAR.fullmatch(x)
+    assert m, x
+    if m['year']:
+        return int(m['year'])
+    if m['century']:
+        y1 = int(m['century'] + m['a'])
+        y2 = int(m['century'] + m['b'])
+    else:
+        y1 = int(m['y1'])
+        y2 = int(m['y2'])
+    y = round((y1 + y2) / 2)
+    return y
 
 
 def main():
@@ -72,6 +77,7 @@ def main():
         input_data = json.load(f)
 
     samplemap = {}
+    bysample = {}
 
     for d in input_data['samples']:
         sample = d['sample']
@@ -79,29 +85,36 @@ def main():
         wordcount = d['words']
         year = parse_year(d['year'])
         samplecode = f'{corpus}-{sample}'
+        speech, legal = GENRE_META[d['genre']]
         samplemap[samplecode] = dict(
             id=samplecode,
             words=wordcount,
             metadata=dict(
                 corpus=d['corpus'],
                 genre=d['genre'],
-                speech=CLASS_SPEECH[d['genre']],
-                legal=CLASS_LEGAL[d['genre']],
+                speech=speech,
+                legal=legal,
             ),
             tokens=[],
             year=year,
         )
+        bysample[(corpus, sample)] = samplemap[samplecode]
+
+    # Tokens with the same variant share one metadata dict
+    token_metadata = {}
 
     for token in input_data['tokens']:
         corpus, sample, dataset, token, before, word, after = token
-        samplecode = f'{corpus}-{sample}'
-        s = samplemap[samplecode]
-        s['tokens'].append(dict(
-            lemma=token,
-            metadata=dict(variant=dataset),
-        ))
+        s = bysample[(corpus, sample)]
+        if dataset not in token_metadata:
+            token_metadata[dataset] = dict(variant=dataset)
+        s['tokens'].append(
+            dict(
+                lemma=token,
+                metadata=token_metadata[dataset],
+            ))
 
-    samples = sorted(samplemap.values(), key=lambda x: x['id'])
+    samples = sorted(samplemap.values(), key=itemgetter('id'))
     data = dict(samples=samples)
 
     with open(destfile, 'w') as f:
@@ -1,11 +1,14 @@
 import json
 import sqlite3
 import sys
+from operator import itemgetter
+from pathlib import Path
 
 
 def main():
     srcfile, destfile = sys.argv[1:]
-    con = sqlite3.connect(srcfile)
+    uri = Path(srcfile).resolve().as_uri() + '?mode=ro'
+    con = sqlite3.connect(uri, uri=True)
     cur = con.cursor()
 
     corpuscode = 'ceec-1680-1800'
@@ -26,6 +29,9 @@ def main():
             year=None,
         )
 
+    # Tokens with the same variant share one metadata dict
+    token_metadata = {}
+
     for samplecode, datasetcode, tokencode, tokencount in cur.execute(
             '''
         SELECT samplecode, datasetcode, tokencode, tokencount
@@ -33,12 +39,14 @@ def main():
         WHERE corpuscode = ?
         ORDER BY tokencode
     ''', [corpuscode]):
-        for _ in range(tokencount):
-            samplemap[samplecode]['tokens'].append(
-                dict(
-                    lemma=tokencode,
-                    metadata=dict(variant=datasetcode, ),
-                ))
+        if datasetcode not in token_metadata:
+            token_metadata[datasetcode] = dict(variant=datasetcode, )
+        # Repeated tokens are the same object, written out once per copy
+        token = dict(
+            lemma=tokencode,
+            metadata=token_metadata[datasetcode],
+        )
+        samplemap[samplecode]['tokens'].extend([token] * tokencount)
 
     for samplecode, groupcode, collectioncode in cur.execute(
             '''
@@ -47,19 +55,20 @@ def main():
         JOIN collection USING (corpuscode, collectioncode)
         WHERE corpuscode = ?
     ''', [corpuscode]):
+        s = samplemap[samplecode]
         if groupcode == 'period':
-            samplemap[samplecode]['year'] = int(collectioncode)
+            s['year'] = int(collectioncode)
         elif groupcode == 'gender':
-            samplemap[samplecode]['metadata'][groupcode] = {
+            s['metadata'][groupcode] = {
                 'F': 'female',
                 'M': 'male'
             }[collectioncode]
         elif groupcode == 'socmob':
-            samplemap[samplecode]['metadata'][groupcode] = collectioncode
+            s['metadata'][groupcode] = collectioncode
         else:
             pass
 
-    samples = sorted(samplemap.values(), key=lambda x: x['id'])
+    samples = sorted(samplemap.values(), key=itemgetter('id'))
     data = dict(samples=samples)
 
     with open(destfile, 'w') as f:
@@ -6,4 +6,4 @@ cargo build --release
 python3 -m venv venv
 source venv/bin/activate
 python3 -m pip install --upgrade pip
-python3 -m pip install appdirs matplotlib yapf
+python3 -m pip install appdirs matplotlib numpy yapf